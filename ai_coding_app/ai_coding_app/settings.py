@@ -82,6 +82,10 @@ DATABASES = {
     }
 }
 
+# Cache of note coding results, keyed by note content and embedding model
+
+CODE_SCORE_CACHE_PATH = BASE_DIR / "code_score_cache.sqlite3"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -36,3 +36,13 @@ class CodeAssignmentAdmin(admin.ModelAdmin):
     search_fields = ('note__note_id', 'icd_code__icd_code')
     list_filter = ('created_at',)
     ordering = ('-similarity_score',)
+
+    def get_queryset(self, request):
+        """
+        Join the related note and ICD-10 code so each row renders without extra queries.
+
+        :param request: The HTTP request object
+        :return: The queryset of code assignments with related objects loaded
+        :rtype: QuerySet
+        """
+        return super().get_queryset(request).select_related('note', 'icd_code')
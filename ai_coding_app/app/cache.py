@@ -0,0 +1,93 @@
+import hashlib
+import sqlite3
+from contextlib import closing
+
+
+class CodeScoreCache:
+    """
+    SQLite-backed cache of the best matching ICD-10 code for a note.
+    Entries are keyed by a hash of the note content, the embedding model and the identity
+    of the vector store searched, so a hit skips both the embedding request and the vector
+    search, and a rebuilt vector store never serves matches from the previous one.
+
+    Attributes:
+        path (str): Path to the SQLite database file holding the cache
+    """
+
+    def __init__(self, path) -> None:
+        """
+        Open the cache, creating its table if it does not exist yet.
+
+        :param path: Path to the SQLite database file
+        """
+        self.path = path
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS code_scores ("
+                "key TEXT PRIMARY KEY, "
+                "icd_code TEXT NOT NULL, "
+                "short_description TEXT NOT NULL, "
+                "score REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(content: str, model: str, store: str) -> str:
+        """
+        Build the cache key for a note.
+
+        :param content: The content of the note
+        :param model: The name of the embedding model used to code the note
+        :param store: The identity of the vector store searched for the note
+        :return: The SHA-256 hex digest identifying the note, model and vector store
+        :rtype: str
+        """
+        return hashlib.sha256("\0".join((content, model, store)).encode()).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up cached matches for several keys at once.
+
+        :param keys: The cache keys to look up
+        :return: Mapping of each cached key to its match; missing keys are omitted
+        :rtype: dict
+        """
+        if not keys:
+            return {}
+
+        placeholders = ', '.join('?' * len(keys))
+        with closing(sqlite3.connect(self.path)) as conn:
+            rows = conn.execute(
+                f"SELECT key, icd_code, short_description, score FROM code_scores WHERE key IN ({placeholders})",
+                list(keys)
+            ).fetchall()
+
+        return {
+            key: {
+                'icd_code': icd_code,
+                'short_description': short_description,
+                'similarity_score': score
+            }
+            for key, icd_code, short_description, score in rows
+        }
+
+    def set_many(self, matches: dict) -> None:
+        """
+        Store matches for several keys at once, replacing existing entries.
+
+        :param matches: Mapping of cache key to a match with icd_code, short_description and similarity_score
+        """
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO code_scores (key, icd_code, short_description, score) VALUES (?, ?, ?, ?)",
+                [
+                    (key, match['icd_code'], match['short_description'], match['similarity_score'])
+                    for key, match in matches.items()
+                ]
+            )
+
+    def clear(self) -> None:
+        """
+        Remove every entry, e.g. after the vector store has been rebuilt.
+        """
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("DELETE FROM code_scores")
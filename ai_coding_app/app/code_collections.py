@@ -0,0 +1,56 @@
+from operator import attrgetter
+
+# Name of the collection holding every ICD-10 code
+COLLECTION_NAME = "g_codes"
+
+# Prefix of the per-cluster collections written by vector store builds that predate COLLECTION_NAME
+LEGACY_CLUSTER_PREFIX = "g_codes_cluster_"
+
+
+def get_code_collections(chroma_client) -> list:
+    """
+    Return the Chroma collections holding the ICD-10 codes.
+    Normally this is the single code collection; vector stores built before it existed
+    hold one collection per cluster, and all of those are returned instead, ordered by name.
+
+    :param chroma_client: The ChromaDB client of the vector store
+    :return: The code collections
+    :rtype: list
+    """
+    collections = chroma_client.list_collections()
+
+    for collection in collections:
+        if collection.name == COLLECTION_NAME:
+            return [collection]
+
+    return sorted(
+        (collection for collection in collections if collection.name.startswith(LEGACY_CLUSTER_PREFIX)),
+        key=attrgetter('name')
+    )
+
+
+def get_store_identity(collections: list) -> str:
+    """
+    Identify the vector store a set of code collections belongs to.
+    Builds record a unique build_id in each collection's metadata; collections without one
+    fall back to their id, which also changes whenever a collection is recreated.
+
+    :param collections: Collections returned by get_code_collections
+    :return: A string that changes whenever the vector store is rebuilt
+    :rtype: str
+    """
+    return ",".join(
+        f"{collection.name}:{(collection.metadata or {}).get('build_id', collection.id)}"
+        for collection in collections
+    )
+
+
+def is_legacy_layout(collections: list) -> bool:
+    """
+    Tell whether code collections use the legacy one-collection-per-cluster layout.
+
+    :param collections: Collections returned by get_code_collections
+    :return: True if each collection holds a single cluster
+    :rtype: bool
+    """
+    return any(collection.name != COLLECTION_NAME for collection in collections)
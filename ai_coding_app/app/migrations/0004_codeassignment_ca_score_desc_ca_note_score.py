@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-14 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0003_icd10code_codeassignment"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="codeassignment",
+            index=models.Index(fields=["-similarity_score"], name="ca_score_desc"),
+        ),
+        migrations.AddIndex(
+            model_name="codeassignment",
+            index=models.Index(
+                fields=["note", "-similarity_score"], name="ca_note_score"
+            ),
+        ),
+    ]
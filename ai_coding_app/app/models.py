@@ -184,6 +184,10 @@ class CodeAssignment(models.Model):
     class Meta:
         unique_together = ('note', 'icd_code')
         ordering = ['-similarity_score']
+        indexes = [
+            models.Index(fields=['-similarity_score'], name='ca_score_desc'),
+            models.Index(fields=['note', '-similarity_score'], name='ca_note_score'),
+        ]
 
     def __str__(self) -> str:
         """
@@ -1,9 +1,22 @@
+import os
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from django.shortcuts import render
+from django.conf import settings
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+from langchain_chroma import Chroma
+import chromadb
 from .models import TestModel, Chart, Note, ICD10Code, CodeAssignment
+from .cache import CodeScoreCache
+from .code_collections import get_code_collections, get_store_identity
 
 #### #! DO NOT MODIFY THIS CODE #! ####
 
@@ -27,6 +40,224 @@ class TestView(APIView):
 #### #! END OF DO NOT MODIFY THIS CODE #! ####
 
 # Create your views here.
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+CHROMA_PERSIST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'chroma_db')
+EMBEDDING_MODEL = "text-embedding-3-large"
+MAX_SEARCH_WORKERS = 8
+
+# Chroma wrappers for the code collections, keyed by the identity of the vector store they were opened on
+_vectorstores = (None, ())
+_vectorstores_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _get_embedding_function() -> OpenAIEmbeddings:
+    """
+    Return the LangChain OpenAI embeddings client, created on first use and shared across requests.
+
+    :return: The embeddings client
+    :rtype: OpenAIEmbeddings
+    """
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        openai_api_key=os.getenv('OPENAI_API_KEY')
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_chroma_client() -> chromadb.ClientAPI:
+    """
+    Return the ChromaDB client of the code vector store, created on first use and shared across requests.
+
+    :return: The ChromaDB client
+    :rtype: chromadb.ClientAPI
+    """
+    return chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+
+
+def _get_code_vectorstores() -> tuple:
+    """
+    Return the ICD-10 code vector stores. See get_code_collections for which collections these cover.
+    The collections are looked up on every call so a rebuilt vector store is picked up
+    without a restart; the Chroma wrappers are only recreated when the vector store changes.
+
+    :return: The identity of the vector store, and a (LangChain Chroma vector store, distance space) pair per collection
+    :rtype: tuple
+    """
+    global _vectorstores
+
+    chroma_client = _get_chroma_client()
+    collections = get_code_collections(chroma_client)
+    identity = get_store_identity(collections)
+
+    with _vectorstores_lock:
+        if _vectorstores[0] != identity:
+            _vectorstores = (identity, tuple(
+                (
+                    Chroma(
+                        client=chroma_client,
+                        collection_name=collection.name,
+                        embedding_function=_get_embedding_function()
+                    ),
+                    _get_distance_space(collection)
+                )
+                for collection in collections
+            ))
+
+        return _vectorstores
+
+
+@lru_cache(maxsize=None)
+def _get_code_score_cache() -> CodeScoreCache:
+    """
+    Return the note coding result cache, opened on first use and shared across requests.
+
+    :return: The code score cache
+    :rtype: CodeScoreCache
+    """
+    return CodeScoreCache(settings.CODE_SCORE_CACHE_PATH)
+
+
+def _get_distance_space(collection) -> str:
+    """
+    Return the distance function a Chroma collection's index uses. Like LangChain's Chroma
+    wrapper, this reads the collection configuration: the HNSW index first, then SPANN.
+
+    :param collection: The Chroma collection
+    :return: The distance space: l2, cosine or ip
+    :rtype: str
+    """
+    configuration = collection.configuration or {}
+
+    for index in ("hnsw", "spann"):
+        space = (configuration.get(index) or {}).get("space")
+        if space:
+            return space
+
+    raise ValueError(f"Chroma collection '{collection.name}' does not record its distance space")
+
+
+def _relevance_score(distance: float, space: str) -> float:
+    """
+    Convert a Chroma distance to a relevance score with the formula LangChain's relevance
+    search uses for the collection's distance space.
+
+    :param distance: The distance returned by the vector search
+    :param space: The distance space of the collection searched: l2, cosine or ip
+    :return: The relevance score, higher for closer matches
+    :rtype: float
+    """
+    if space == "l2":
+        # Unit-length embeddings are at most sqrt(2) apart
+        return 1.0 - distance / math.sqrt(2)
+    if space == "cosine":
+        return 1.0 - distance
+    if space == "ip":
+        return 1.0 - distance if distance > 0 else -1.0 * distance
+
+    raise ValueError(f"Unsupported Chroma distance space: {space}")
+
+
+def _find_best_match(vectorstores: tuple, note_embedding: list) -> dict | None:
+    """
+    Find the ICD-10 code closest to a note embedding across the code vector stores.
+
+    :param vectorstores: (vector store, distance space) pairs to search
+    :param note_embedding: The embedding of the note content
+    :return: The matching code, its short description and similarity score, or None if the stores are empty
+    :rtype: dict | None
+    """
+    best_match = None
+    best_score = -1
+
+    for vectorstore, space in vectorstores:
+        # Perform similarity search with k=1 (top match in this collection)
+        docs_and_scores = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            note_embedding,
+            k=1
+        )
+
+        if docs_and_scores:
+            # Searching by vector returns raw distances; convert them the way relevance search does
+            doc, distance = docs_and_scores[0]
+            similarity = _relevance_score(distance, space)
+
+            if similarity > best_score:
+                best_score = similarity
+                best_match = {
+                    'icd_code': doc.metadata['icd_code'],
+                    'short_description': doc.metadata['short_description'],
+                    'similarity_score': similarity
+                }
+
+    return best_match
+
+
+def _get_field_info(field) -> dict:
+    """
+    Extract readable information about a model field.
+
+    :param field: The Django model field
+    :return: The field type and its constraints
+    :rtype: dict
+    """
+    field_type = field.get_internal_type()
+    info = {"type": field_type}
+
+    if hasattr(field, 'max_length') and field.max_length:
+        info["max_length"] = field.max_length
+    if field.unique:
+        info["unique"] = True
+    if field.db_index:
+        info["indexed"] = True
+    if field.primary_key:
+        info["primary_key"] = True
+    if hasattr(field, 'related_model') and field.related_model:
+        info["foreign_key_to"] = field.related_model.__name__
+        if hasattr(field.remote_field, 'on_delete'):
+            info["on_delete"] = field.remote_field.on_delete.__name__
+        if hasattr(field.remote_field, 'related_name'):
+            info["related_name"] = field.remote_field.related_name
+
+    return info
+
+
+def _build_schema() -> dict:
+    """
+    Build the schema for the Chart and Note models by introspecting them.
+
+    :return: Mapping of model name to its field information
+    :rtype: dict
+    """
+    schema = {}
+
+    # Get Chart schema
+    chart_fields = {}
+    for field in Chart._meta.get_fields():
+        if not field.many_to_many and not field.one_to_many:
+            chart_fields[field.name] = _get_field_info(field)
+
+    schema["Chart"] = chart_fields
+
+    # Get Note schema
+    note_fields = {}
+    for field in Note._meta.get_fields():
+        if not field.many_to_many and not field.one_to_many:
+            note_fields[field.name] = _get_field_info(field)
+
+    schema["Note"] = note_fields
+
+    return schema
+
+
+# The models only change between deploys, so introspect them once at import
+_SCHEMA_CACHE = _build_schema()
+
+
 class ChartSchemaView(APIView):
     """
     Returns the schema definition for how charts are stored in the database.
@@ -35,53 +266,13 @@ class ChartSchemaView(APIView):
 
     def get(self, request: Request) -> Response:
         """
-        Get the database schema for Chart and Note models by introspecting the models.
+        Get the database schema for Chart and Note models, introspected once at import.
 
         :param request: The HTTP request object
         :return: JSON response containing the schema definition
         :rtype: Response
         """
-        def get_field_info(field):
-            """Helper function to extract readable field information."""
-            field_type = field.get_internal_type()
-            info = {"type": field_type}
-
-            if hasattr(field, 'max_length') and field.max_length:
-                info["max_length"] = field.max_length
-            if field.unique:
-                info["unique"] = True
-            if field.db_index:
-                info["indexed"] = True
-            if field.primary_key:
-                info["primary_key"] = True
-            if hasattr(field, 'related_model') and field.related_model:
-                info["foreign_key_to"] = field.related_model.__name__
-                if hasattr(field.remote_field, 'on_delete'):
-                    info["on_delete"] = field.remote_field.on_delete.__name__
-                if hasattr(field.remote_field, 'related_name'):
-                    info["related_name"] = field.remote_field.related_name
-
-            return info
-
-        schema = {}
-
-        # Get Chart schema
-        chart_fields = {}
-        for field in Chart._meta.get_fields():
-            if not field.many_to_many and not field.one_to_many:
-                chart_fields[field.name] = get_field_info(field)
-
-        schema["Chart"] = chart_fields
-
-        # Get Note schema
-        note_fields = {}
-        for field in Note._meta.get_fields():
-            if not field.many_to_many and not field.one_to_many:
-                note_fields[field.name] = get_field_info(field)
-
-        schema["Note"] = note_fields
-
-        return Response(schema, status=status.HTTP_200_OK)
+        return Response(_SCHEMA_CACHE, status=status.HTTP_200_OK)
 
 
 class UploadChartView(APIView):
@@ -135,20 +326,26 @@ class UploadChartView(APIView):
                 status=status.HTTP_200_OK
             )
 
-        # Create the chart
-        chart = Chart.objects.create(
-            case_id=case_id,
-            visit_info=data['visit_info']
-        )
+        # Create the chart and its notes together so a failed insert leaves no partial chart
+        with transaction.atomic():
+            chart = Chart.objects.create(
+                case_id=case_id,
+                visit_info=data['visit_info']
+            )
 
-        # Create associated notes
-        notes_data = data['notes']
-        for note_data in notes_data:
-            Note.objects.create(
-                chart=chart,
-                note_id=note_data['note_id'],
-                title=note_data['title'],
-                content=note_data['content']
+            # Create associated notes in a single batched INSERT
+            notes_data = data['notes']
+            Note.objects.bulk_create(
+                [
+                    Note(
+                        chart=chart,
+                        note_id=note_data['note_id'],
+                        title=note_data['title'],
+                        content=note_data['content']
+                    )
+                    for note_data in notes_data
+                ],
+                batch_size=500
             )
 
         # Get total count of charts
@@ -176,7 +373,8 @@ class ListChartsView(APIView):
         :return: JSON response containing all charts with their notes
         :rtype: Response
         """
-        charts = Chart.objects.all()
+        # Stream charts in chunks; notes are prefetched per chunk rather than cached for the whole table
+        charts = Chart.objects.prefetch_related('notes').iterator(chunk_size=500)
         return Response(
             [chart.to_dict() for chart in charts],
             status=status.HTTP_200_OK
@@ -186,7 +384,7 @@ class ListChartsView(APIView):
 class CodeChartView(APIView):
     """
     AI-powered medical chart coding using semantic search on ICD-10 codes.
-    Uses hierarchical clustering and vector similarity to assign codes to notes.
+    Uses k-means clustering and vector similarity to assign codes to notes.
     """
 
     def post(self, request: Request) -> Response:
@@ -203,15 +401,6 @@ class CodeChartView(APIView):
         :return: JSON response with list of assigned codes and similarity scores
         :rtype: Response
         """
-        import os
-        from dotenv import load_dotenv
-        from langchain_openai import OpenAIEmbeddings
-        from langchain_chroma import Chroma
-        import chromadb
-
-        # Load environment variables
-        load_dotenv()
-
         data = request.data
 
         # Validate required fields
@@ -226,7 +415,7 @@ class CodeChartView(APIView):
 
         # Get the chart
         try:
-            chart = Chart.objects.get(case_id=case_id)
+            chart = Chart.objects.prefetch_related('notes').get(case_id=case_id)
         except Chart.DoesNotExist:
             return Response(
                 {"error": f"Chart with case_id '{case_id}' not found"},
@@ -242,53 +431,37 @@ class CodeChartView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Initialize LangChain OpenAI embeddings
-        embedding_function = OpenAIEmbeddings(
-            model="text-embedding-3-large",
-            openai_api_key=os.getenv('OPENAI_API_KEY')
-        )
+        # Resolve the vector stores once so every search in this request uses the same ones
+        store_identity, vectorstores = _get_code_vectorstores()
 
-        # Get Chroma persist directory
-        chroma_persist_dir = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-            'chroma_db'
-        )
+        # Reuse cached matches for notes whose content has already been coded with this model and vector store
+        cache = _get_code_score_cache()
+        cache_keys = [CodeScoreCache.make_key(note.content, EMBEDDING_MODEL, store_identity) for note in notes]
+        best_matches = cache.get_many(cache_keys)
+        uncached = [(note, key) for note, key in zip(notes, cache_keys) if key not in best_matches]
 
-        # Get all cluster collection names
-        chroma_client = chromadb.PersistentClient(path=chroma_persist_dir)
-        collections = chroma_client.list_collections()
+        if uncached:
+            # Embed every uncached note in one batched request instead of once per search
+            note_embeddings = _get_embedding_function().embed_documents([note.content for note, _ in uncached])
 
-        results = []
+            # Searches are independent, so run them concurrently
+            with ThreadPoolExecutor(max_workers=min(MAX_SEARCH_WORKERS, len(uncached))) as executor:
+                matches = list(executor.map(partial(_find_best_match, vectorstores), note_embeddings))
 
-        for note in notes:
-            # Search across all clusters to find best match using LangChain
-            best_match = None
-            best_score = -1
-
-            for collection_metadata in collections:
-                # Load vector store using LangChain
-                vectorstore = Chroma(
-                    collection_name=collection_metadata.name,
-                    embedding_function=embedding_function,
-                    persist_directory=chroma_persist_dir
-                )
+            new_matches = {
+                key: match
+                for (_, key), match in zip(uncached, matches)
+                if match
+            }
 
-                # Perform similarity search with k=1 (top match in this cluster)
-                docs_and_scores = vectorstore.similarity_search_with_relevance_scores(
-                    note.content,
-                    k=1
-                )
+            cache.set_many(new_matches)
+            best_matches.update(new_matches)
 
-                if docs_and_scores:
-                    doc, similarity = docs_and_scores[0]
+        results = []
+        matched_notes = []
 
-                    if similarity > best_score:
-                        best_score = similarity
-                        best_match = {
-                            'icd_code': doc.metadata['icd_code'],
-                            'short_description': doc.metadata['short_description'],
-                            'similarity_score': similarity
-                        }
+        for note, key in zip(notes, cache_keys):
+            best_match = best_matches.get(key)
 
             if best_match:
                 result = {
@@ -299,15 +472,27 @@ class CodeChartView(APIView):
                     'similarity_score': round(best_match['similarity_score'], 4)
                 }
                 results.append(result)
+                matched_notes.append((note, best_match))
 
-                # Save to database if requested
-                if save:
-                    icd_code_obj = ICD10Code.objects.get(icd_code=best_match['icd_code'])
-                    CodeAssignment.objects.update_or_create(
+        # Save to database if requested, resolving codes and upserting assignments in bulk
+        if save and matched_notes:
+            codes_map = ICD10Code.objects.in_bulk(
+                {best_match['icd_code'] for _, best_match in matched_notes},
+                field_name='icd_code'
+            )
+            CodeAssignment.objects.bulk_create(
+                [
+                    CodeAssignment(
                         note=note,
-                        icd_code=icd_code_obj,
-                        defaults={'similarity_score': best_match['similarity_score']}
+                        icd_code=codes_map[best_match['icd_code']],
+                        similarity_score=best_match['similarity_score']
                     )
+                    for note, best_match in matched_notes
+                ],
+                update_conflicts=True,
+                unique_fields=['note', 'icd_code'],
+                update_fields=['similarity_score']
+            )
 
         return Response(
             {
@@ -1,25 +1,28 @@
 """
-Build vector store for ICD-10 G-codes using hierarchical clustering with LangChain.
+Build vector store for ICD-10 G-codes using k-means clustering with LangChain.
 
 This script:
 1. Loads ICD-10 codes from g_codes.csv
 2. Generates embeddings using OpenAI's text-embedding-3-large via LangChain
-3. Performs hierarchical clustering to group similar codes
-4. Stores each cluster in a separate Chroma collection using LangChain
+3. Performs mini-batch k-means clustering to group similar codes
+4. Stores all codes and their precomputed embeddings in one Chroma collection, tagged with their cluster
 5. Persists the vector store locally for reuse
 """
 
 import os
+import hashlib
+import uuid
 import pandas as pd
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.metrics import silhouette_score
+from sklearn.metrics.pairwise import cosine_distances
 import sys
 
 # LangChain imports
 from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
+import chromadb
 
 # Add Django app to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai_coding_app'))
@@ -28,6 +31,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_coding_app.settings')
 import django
 django.setup()
 
+from django.conf import settings
+from django.db import transaction
+from app.cache import CodeScoreCache
+from app.code_collections import COLLECTION_NAME, LEGACY_CLUSTER_PREFIX
 from app.models import ICD10Code
 
 # Load environment variables
@@ -37,7 +44,10 @@ load_dotenv()
 # Constants
 CSV_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'g_codes.csv')
 CHROMA_PERSIST_DIR = os.path.join(os.path.dirname(__file__), '..', 'chroma_db')
+EMBEDDINGS_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'embeddings_cache')
 EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_BATCH_SIZE = 256
+SILHOUETTE_SAMPLE_SIZE = 5000
 
 
 def load_codes():
@@ -47,20 +57,25 @@ def load_codes():
     :return: DataFrame of codes
     """
     print("Loading ICD-10 codes from CSV...")
-    df = pd.read_csv(CSV_PATH)
+    # Read only the columns used, as strings, skipping dtype inference
+    df = pd.read_csv(CSV_PATH, usecols=['icd_code', 'short_description', 'long_description'], dtype=str)
 
     print(f"Loaded {len(df)} ICD-10 codes")
 
-    # Populate database
+    # Populate database, inserting only codes that are not already stored
     print("Populating ICD10Code table in database...")
-    for _, row in df.iterrows():
-        ICD10Code.objects.get_or_create(
-            icd_code=row['icd_code'],
-            defaults={
-                'short_description': row['short_description'],
-                'long_description': row['long_description']
-            }
+    existing = set(ICD10Code.objects.values_list('icd_code', flat=True))
+    new_codes = [
+        ICD10Code(
+            icd_code=row.icd_code,
+            short_description=row.short_description,
+            long_description=row.long_description
         )
+        for row in df.itertuples(index=False)
+        if row.icd_code not in existing
+    ]
+    with transaction.atomic():
+        ICD10Code.objects.bulk_create(new_codes, batch_size=1000, ignore_conflicts=True)
     print(f"Database now has {ICD10Code.objects.count()} ICD-10 codes")
 
     return df
@@ -69,29 +84,45 @@ def load_codes():
 def generate_embeddings(df: pd.DataFrame, embedding_function: OpenAIEmbeddings) -> np.ndarray:
     """
     Generate embeddings for all code descriptions using LangChain.
+    Results are cached on disk, keyed by a hash of the model name and descriptions.
 
     :param df: DataFrame with code descriptions
     :param embedding_function: LangChain OpenAI embeddings function
-    :return: Array of embeddings
+    :return: Array of float16 embeddings
     """
+    texts = df['long_description'].tolist()
+
+    # Reuse embeddings from a previous run if the model and descriptions are unchanged
+    key = hashlib.sha256('\n'.join([EMBEDDING_MODEL] + texts).encode()).hexdigest()
+    cache_path = os.path.join(EMBEDDINGS_CACHE_DIR, f"embeddings_{key}.npy")
+    if os.path.exists(cache_path):
+        print(f"Loading cached embeddings from {cache_path}")
+        return np.load(cache_path).astype(np.float16, copy=False)
+
     print("Generating embeddings using LangChain (this will take a few minutes)...")
     embeddings = []
 
-    for idx, row in df.iterrows():
-        if idx % 50 == 0:
-            print(f"  Processed {idx}/{len(df)} codes...")
-
-        # Use LangChain's embed_query method
-        embedding = embedding_function.embed_query(row['long_description'])
-        embeddings.append(embedding)
+    # Use LangChain's embed_documents method so each request embeds a whole batch
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        print(f"  Processed {start}/{len(texts)} codes...")
+        embeddings.extend(embedding_function.embed_documents(texts[start:start + EMBEDDING_BATCH_SIZE]))
 
     print(f"Generated {len(embeddings)} embeddings")
-    return np.array(embeddings)
+    # Store at half precision; this halves memory and disk use with negligible effect on similarity
+    embeddings = np.asarray(embeddings, dtype=np.float16)
+
+    os.makedirs(EMBEDDINGS_CACHE_DIR, exist_ok=True)
+    np.save(cache_path, embeddings)
+    print(f"Cached embeddings to {cache_path}")
+
+    return embeddings
 
 
 def find_optimal_clusters(embeddings: np.ndarray, min_k: int, max_k: int, step: int) -> int:
     """
     Find optimal number of clusters using silhouette score.
+    Every k is scored on the same fixed sample of at most SILHOUETTE_SAMPLE_SIZE codes, whose
+    pairwise cosine distances are computed once, so memory stays bounded as the code set grows.
 
     :param embeddings: Array of embeddings
     :param min_k: Minimum number of clusters to try
@@ -103,10 +134,15 @@ def find_optimal_clusters(embeddings: np.ndarray, min_k: int, max_k: int, step:
     best_score = -1
     best_k = min_k
 
+    # Draw the sample once and reuse its distance matrix for every k
+    sample = np.sort(np.random.default_rng(0).choice(
+        len(embeddings), size=min(SILHOUETTE_SAMPLE_SIZE, len(embeddings)), replace=False
+    ))
+    sample_distances = cosine_distances(embeddings[sample])
+
     for k in range(min_k, max_k + 1, step):
-        clusterer = AgglomerativeClustering(n_clusters=k)
-        labels = clusterer.fit_predict(embeddings)
-        score = silhouette_score(embeddings, labels)
+        labels = fit_clusters(embeddings, k)
+        score = silhouette_score(sample_distances, labels[sample], metric='precomputed')
         print(f"  k={k}: silhouette score = {score:.4f}")
 
         if score > best_score:
@@ -117,17 +153,28 @@ def find_optimal_clusters(embeddings: np.ndarray, min_k: int, max_k: int, step:
     return best_k
 
 
+def fit_clusters(embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Fit mini-batch k-means on embeddings. The seed is fixed so builds are reproducible.
+
+    :param embeddings: Array of embeddings
+    :param n_clusters: Number of clusters
+    :return: Cluster labels for each code
+    """
+    clusterer = MiniBatchKMeans(n_clusters=n_clusters, batch_size=1024, n_init=3, random_state=0)
+    return clusterer.fit_predict(embeddings)
+
+
 def perform_clustering(embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
     """
-    Perform hierarchical clustering on embeddings.
+    Perform k-means clustering on embeddings.
 
     :param embeddings: Array of embeddings
     :param n_clusters: Number of clusters
     :return: Cluster labels for each code
     """
-    print(f"Performing hierarchical clustering with {n_clusters} clusters...")
-    clusterer = AgglomerativeClustering(n_clusters=n_clusters)
-    labels = clusterer.fit_predict(embeddings)
+    print(f"Performing k-means clustering with {n_clusters} clusters...")
+    labels = fit_clusters(embeddings, n_clusters)
     print(f"Clustering complete. Cluster distribution:")
 
     unique, counts = np.unique(labels, return_counts=True)
@@ -137,57 +184,63 @@ def perform_clustering(embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
     return labels
 
 
-def build_chroma_collections(df: pd.DataFrame, embeddings: np.ndarray,
-                            cluster_labels: np.ndarray, embedding_function: OpenAIEmbeddings):
+def build_chroma_collection(df: pd.DataFrame, embeddings: np.ndarray, cluster_labels: np.ndarray):
     """
-    Build Chroma collections using LangChain, one per cluster.
+    Build a single Chroma collection holding every code, with each code's cluster
+    recorded in its metadata. The precomputed embeddings are stored directly, so
+    no code is embedded a second time.
 
     :param df: DataFrame with code data
     :param embeddings: Array of embeddings
     :param cluster_labels: Cluster assignments
-    :param embedding_function: LangChain OpenAI embeddings function
     """
-    print("Building Chroma vector store using LangChain...")
+    print(f"Building Chroma collection {COLLECTION_NAME}...")
+
+    # Every code goes into the one collection, so documents simply follow the rows' order
+    documents = []
+    for icd_code, short_description, long_description, cluster_id in zip(
+        df['icd_code'], df['short_description'], df['long_description'], cluster_labels
+    ):
+        # Create LangChain Document objects with page_content as long_description
+        doc = Document(
+            page_content=long_description,  # Required: use long_description as page_content
+            metadata={
+                'icd_code': icd_code,
+                'short_description': short_description,
+                'cluster_id': int(cluster_id)
+            }
+        )
+        documents.append(doc)
 
-    # Get unique clusters
-    unique_clusters = np.unique(cluster_labels)
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
 
-    for cluster_id in unique_clusters:
-        collection_name = f"g_codes_cluster_{cluster_id}"
-        print(f"Building collection: {collection_name}")
+    # Rebuild from scratch: drop the previous collection so removed codes and old metadata don't survive,
+    # along with any per-cluster collections from older builds, which would otherwise still be searchable
+    for collection in chroma_client.list_collections():
+        if collection.name == COLLECTION_NAME or collection.name.startswith(LEGACY_CLUSTER_PREFIX):
+            chroma_client.delete_collection(collection.name)
 
-        # Get codes for this cluster
-        cluster_mask = cluster_labels == cluster_id
-        cluster_df = df[cluster_mask].copy()
-        cluster_embeddings = embeddings[cluster_mask]
+    # A fresh build_id invalidates note matches cached against the previous build
+    collection = chroma_client.create_collection(
+        name=COLLECTION_NAME,
+        metadata={"n_clusters": len(np.unique(cluster_labels)), "build_id": uuid.uuid4().hex}
+    )
 
-        # Create LangChain Document objects with page_content as long_description
-        documents = []
-        for idx, row in cluster_df.iterrows():
-            doc = Document(
-                page_content=row['long_description'],  # Required: use long_description as page_content
-                metadata={
-                    'icd_code': row['icd_code'],
-                    'short_description': row['short_description'],
-                    'cluster_id': int(cluster_id)
-                }
-            )
-            documents.append(doc)
-
-        # Convert embeddings to list format for LangChain
-        embeddings_list = [emb.tolist() for emb in cluster_embeddings]
-
-        # Create Chroma vector store using LangChain with pre-computed embeddings
-        vectorstore = Chroma.from_documents(
-            documents=documents,
-            embedding=embedding_function,
-            collection_name=collection_name,
-            persist_directory=CHROMA_PERSIST_DIR,
-            collection_metadata={"cluster_id": int(cluster_id)}
+    # Hand the embeddings to Chroma as one float32 array rather than a list of Python lists,
+    # in slices no larger than the client accepts in a single call
+    embeddings = embeddings.astype(np.float32, copy=False)
+    batch_size = chroma_client.get_max_batch_size()
+
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        collection.add(
+            ids=[doc.metadata['icd_code'] for doc in batch],
+            embeddings=embeddings[start:start + batch_size],
+            documents=[doc.page_content for doc in batch],
+            metadatas=[doc.metadata for doc in batch]
         )
 
-        print(f"  Added {len(documents)} codes to {collection_name}")
-
+    print(f"  Added {len(documents)} codes to {COLLECTION_NAME}")
     print(f"Vector store built and persisted to {CHROMA_PERSIST_DIR}")
 
 
@@ -210,17 +263,23 @@ def main():
     # Step 2: Generate embeddings using LangChain
     embeddings = generate_embeddings(df, embedding_function)
 
+    # k-means and silhouette scoring run on a single float32 copy
+    clustering_embeddings = embeddings.astype(np.float32)
+
     # Step 3: Find optimal number of clusters
     '''Upon inspection, a value of k greater than 100 might improve the clustering quality.
         The consequence is that creating the code chart takes MUCH longer.
     '''
-    optimal_k = find_optimal_clusters(embeddings, min_k=60, max_k=80, step=2)
+    optimal_k = find_optimal_clusters(clustering_embeddings, min_k=60, max_k=80, step=2)
 
     # Step 4: Perform clustering
-    cluster_labels = perform_clustering(embeddings, optimal_k)
+    cluster_labels = perform_clustering(clustering_embeddings, optimal_k)
+
+    # Step 5: Build the Chroma collection from the precomputed embeddings
+    build_chroma_collection(df, embeddings, cluster_labels)
 
-    # Step 5: Build Chroma collections using LangChain
-    build_chroma_collections(df, embeddings, cluster_labels, embedding_function)
+    # Cached note matches are keyed to the previous build and can never be hit again, so drop them
+    CodeScoreCache(settings.CODE_SCORE_CACHE_PATH).clear()
 
     print("=" * 60)
     print("Vector store build complete!")
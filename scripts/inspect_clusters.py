@@ -1,7 +1,8 @@
 """
-Inspect the hierarchical clustering results stored in ChromaDB.
+Inspect the clustering results stored in ChromaDB.
 
-This script reads all cluster collections and displays:
+This script reads the code collection (or, for older stores, the per-cluster
+collections), groups codes by cluster, and displays:
 - Cluster distribution (how many codes in each cluster)
 - Sample codes from each cluster to understand the grouping logic
 """
@@ -9,7 +10,9 @@ This script reads all cluster collections and displays:
 import os
 import sys
 import chromadb
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 
 # Add Django app to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ai_coding_app'))
@@ -18,72 +21,98 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_coding_app.settings')
 import django
 django.setup()
 
+from app.code_collections import get_code_collections, is_legacy_layout
+
 # Constants
 CHROMA_PERSIST_DIR = os.path.join(os.path.dirname(__file__), '..', 'chroma_db')
+MAX_FETCH_WORKERS = 8
+
+# Summary of one cluster: its id, number of codes, and the codes' metadata
+Cluster = namedtuple('Cluster', ['cluster_id', 'count', 'codes'])
+
+
+def _fetch_metadatas(collection) -> list:
+    """
+    Fetch the metadata of every code in a collection.
+    Documents are never displayed, so they are not transferred.
+
+    :param collection: The Chroma collection to read
+    :return: The metadata of each code in the collection
+    :rtype: list
+    """
+    return collection.get(include=['metadatas'])['metadatas']
 
 
 def inspect_clusters():
-    """Inspect all cluster collections and display their contents."""
-    print("=" * 80)
-    print("ICD-10 G-Codes Hierarchical Clustering Analysis")
-    print("=" * 80)
-    print()
+    """Inspect the clusters in the code collection and display their contents."""
+    # Collect every output line and write them once at the end instead of printing line by line
+    output = []
+
+    output.append("=" * 80)
+    output.append("ICD-10 G-Codes Clustering Analysis")
+    output.append("=" * 80)
+    output.append("")
 
     # Initialize Chroma client
     chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
 
-    # Get all collections
-    collections = chroma_client.list_collections()
+    # Get the collections holding the codes
+    collections = get_code_collections(chroma_client)
+    legacy_layout = is_legacy_layout(collections)
 
-    print(f"Total clusters found: {len(collections)}")
-    print()
+    # Legacy stores hold one collection per cluster; fetch them concurrently rather than one after another
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        fetched = list(executor.map(_fetch_metadatas, collections))
 
-    # Sort collections by cluster ID
-    cluster_data = []
+    # Group codes by cluster: legacy stores record it per collection, otherwise per code
+    clusters = defaultdict(list)
+    for collection, metadatas in zip(collections, fetched):
+        if legacy_layout:
+            cluster_id = (collection.metadata or {}).get('cluster_id', -1)
+            clusters[cluster_id].extend(metadatas)
+        else:
+            for code_data in metadatas:
+                clusters[code_data.get('cluster_id', -1)].append(code_data)
+    del fetched
 
-    for collection_metadata in collections:
-        collection = chroma_client.get_collection(collection_metadata.name)
+    output.append(f"Total clusters found: {len(clusters)}")
+    output.append("")
 
-        # Get all items in this collection
-        results = collection.get(include=['metadatas', 'documents'])
+    cluster_data = []
 
-        cluster_id = collection_metadata.metadata.get('cluster_id', -1)
-        cluster_data.append({
-            'cluster_id': cluster_id,
-            'name': collection_metadata.name,
-            'count': len(results['ids']),
-            'codes': results['metadatas'],
-            'descriptions': results['documents']
-        })
+    for cluster_id, codes in clusters.items():
+        cluster_data.append(Cluster(cluster_id, len(codes), codes))
 
     # Sort by cluster_id
-    cluster_data.sort(key=lambda x: x['cluster_id'])
+    cluster_data.sort(key=attrgetter('cluster_id'))
 
     # Display cluster distribution
-    print("Cluster Distribution:")
-    print("-" * 80)
+    output.append("Cluster Distribution:")
+    output.append("-" * 80)
     for cluster in cluster_data:
-        print(f"Cluster {cluster['cluster_id']:2d}: {cluster['count']:3d} codes")
-    print()
+        output.append(f"Cluster {cluster.cluster_id:2d}: {cluster.count:3d} codes")
+    output.append("")
 
     # Display all codes from each cluster
-    print("All Codes from Each Cluster:")
-    print("=" * 80)
+    output.append("All Codes from Each Cluster:")
+    output.append("=" * 80)
 
     for cluster in cluster_data:
-        print()
-        print(f"CLUSTER {cluster['cluster_id']} ({cluster['count']} codes total)")
-        print("-" * 80)
-
-        # Show all codes from this cluster
-        for i in range(cluster['count']):
-            code_data = cluster['codes'][i]
-            print(f"  {code_data['icd_code']:6s}: {code_data['short_description']}")
-
-    print()
-    print("=" * 80)
-    print("Analysis Complete!")
-    print("=" * 80)
+        header = f"\nCLUSTER {cluster.cluster_id} ({cluster.count} codes total)\n" + "-" * 80
+
+        # Show all codes from this cluster as one block
+        block = "\n".join(
+            f"  {code_data['icd_code']:6s}: {code_data['short_description']}"
+            for code_data in cluster.codes
+        )
+        output.append(header + "\n" + block)
+
+    output.append("")
+    output.append("=" * 80)
+    output.append("Analysis Complete!")
+    output.append("=" * 80)
+
+    sys.stdout.write("\n".join(output) + "\n")
 
 
 if __name__ == "__main__":
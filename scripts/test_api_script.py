@@ -19,8 +19,47 @@ def test_api() -> dict:
 
 # Build your script here.
 
-import re
 import os
+import json
+import atexit
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+
+# orjson encodes requests and decodes responses faster when installed; fall back to the standard library
+try:
+    from orjson import dumps, loads
+except ImportError:
+    from json import loads
+
+    def dumps(obj) -> bytes:
+        """Encode obj as UTF-8 JSON bytes, as orjson.dumps does."""
+        return json.dumps(obj, allow_nan=False).encode('utf-8')
+
+# Shared session so every helper reuses pooled keep-alive connections to the API
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=3)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+atexit.register(_session.close)
+
+# Marks the line holding a note's ID; the last non-blank line before it is the note's title
+NOTE_ID_MARKER = b'\nNote ID:'
+
+def _find_title_line(content: bytes, note_id_pos: int) -> tuple:
+    """
+    Find the title line of a note: the last non-blank line before its Note ID header.
+
+    :param content: The raw chart text.
+    :param note_id_pos: The position of the note's NOTE_ID_MARKER.
+    :return: The start and end positions of the title line.
+    :rtype: tuple
+    """
+    # Skip blank lines between the title and the header
+    title_end = note_id_pos
+    while title_end > 0 and content[title_end - 1] in b' \t\n':
+        title_end -= 1
+
+    return content.rfind(b'\n', 0, title_end) + 1, title_end
 
 def get_chart_schema() -> dict:
     """
@@ -29,12 +68,15 @@ def get_chart_schema() -> dict:
     :return: The API response.
     :rtype: dict
     """
-    response = requests.get(f"{API_BASE_URL}/app/chart-schema/")
-    return response.json()
+    response = _session.get(f"{API_BASE_URL}/app/chart-schema/")
+    return loads(response.content)
 
+@lru_cache(maxsize=1)
 def transform_chart_to_json() -> dict:
     """
     Transform a chart to a JSON object by parsing the medical chart text file.
+    The parsed chart is cached, so the file is only read and parsed once per run;
+    callers must treat the returned dict as read-only.
 
     :return: The JSON object of the chart.
     :rtype: dict
@@ -42,43 +84,42 @@ def transform_chart_to_json() -> dict:
     # Path to the medical chart file
     chart_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'medical_chart.txt')
 
-    with open(chart_path, 'r') as f:
+    # Scan the raw bytes; only the extracted fields are decoded
+    with open(chart_path, 'rb') as f:
         content = f.read()
 
-    # Split into sections
-    sections = re.split(r'\n(?=[A-Z\s]+\n)', content)
+    # Normalize line endings as text mode would
+    if b'\r' in content:
+        content = content.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
 
     notes = []
     visit_info = ""
     case_id = None
 
-    for section in sections:
-        lines = section.strip().split('\n')
-        if len(lines) < 2:
-            continue
+    # Scan forward from one Note ID header to the next; each note is the title line
+    # before its header, then everything up to the next note's title line
+    note_id_pos = content.find(NOTE_ID_MARKER)
+    while note_id_pos != -1:
+        title_start, title_end = _find_title_line(content, note_id_pos)
+        title = content[title_start:title_end].decode('utf-8').strip()
 
-        title = lines[0].strip()
-
-        # Find Note ID line
-        note_id_line = None
-        content_start = 1
-        for i, line in enumerate(lines[1:], 1):
-            if line.startswith('Note ID:'):
-                note_id_line = line
-                content_start = i + 1
-                break
-
-        if not note_id_line:
-            continue
-
-        note_id = note_id_line.replace('Note ID:', '').strip()
+        note_id_start = note_id_pos + len(NOTE_ID_MARKER)
+        note_id_end = content.find(b'\n', note_id_start)
+        if note_id_end == -1:
+            note_id_end = len(content)
+        note_id = content[note_id_start:note_id_end].decode('utf-8').strip()
 
         # Extract case_id from first note_id
         if case_id is None and 'case' in note_id:
             case_id = note_id.split('-')[-1]
 
-        # Get content (everything after Note ID line)
-        note_content = '\n'.join(lines[content_start:]).strip()
+        # Get content (everything after Note ID line, up to the next note's title line)
+        next_note_id_pos = content.find(NOTE_ID_MARKER, note_id_end)
+        if next_note_id_pos == -1:
+            content_end = len(content)
+        else:
+            content_end = _find_title_line(content, next_note_id_pos)[0]
+        note_content = content[note_id_end:content_end].decode('utf-8').strip()
 
         # Special handling for METADATA
         if title == 'METADATA':
@@ -90,6 +131,8 @@ def transform_chart_to_json() -> dict:
                 'content': note_content
             })
 
+        note_id_pos = next_note_id_pos
+
     chart_json = {
         'case_id': case_id,
         'visit_info': visit_info,
@@ -98,6 +141,16 @@ def transform_chart_to_json() -> dict:
 
     return chart_json
 
+@lru_cache(maxsize=1)
+def serialize_chart() -> bytes:
+    """
+    Serialize the transformed chart to a JSON request body once per run.
+
+    :return: The UTF-8 encoded JSON body of the chart.
+    :rtype: bytes
+    """
+    return dumps(transform_chart_to_json())
+
 def upload_chart() -> dict:
     """
     Upload a chart to the API.
@@ -105,9 +158,12 @@ def upload_chart() -> dict:
     :return: The API response.
     :rtype: dict
     """
-    chart_data = transform_chart_to_json()
-    response = requests.post(f"{API_BASE_URL}/app/upload-chart/", json=chart_data)
-    return response.json()
+    response = _session.post(
+        f"{API_BASE_URL}/app/upload-chart/",
+        data=serialize_chart(),
+        headers={'Content-Type': 'application/json'}
+    )
+    return loads(response.content)
 
 def list_charts() -> dict:
     """
@@ -116,8 +172,8 @@ def list_charts() -> dict:
     :return: The API response.
     :rtype: dict
     """
-    response = requests.get(f"{API_BASE_URL}/app/charts/")
-    return response.json()
+    response = _session.get(f"{API_BASE_URL}/app/charts/")
+    return loads(response.content)
 
 def code_chart() -> dict:
     """
@@ -126,17 +182,16 @@ def code_chart() -> dict:
     :return: The API response.
     :rtype: dict
     """
-    # Get the case_id from the transformed chart
-    chart_data = transform_chart_to_json()
-    case_id = chart_data['case_id']
+    # Get the case_id from the transformed chart (memoized, so not parsed again)
+    case_id = transform_chart_to_json()['case_id']
 
     # Code the chart with save=True to persist results
     payload = {
         'case_id': case_id,
         'save': True
     }
-    response = requests.post(f"{API_BASE_URL}/app/code-chart/", json=payload)
-    return response.json()
+    response = _session.post(f"{API_BASE_URL}/app/code-chart/", json=payload)
+    return loads(response.content)
 
 
 #### #! DO NOT MODIFY THIS CODE #! ####